@@ -14,21 +14,24 @@ The general idea from a thread/process management perspective (ignoring the
 - synchronous requests are defined as methods in the `TaskManager` and handled
   in the responding thread directly.
 - Asynchronous requests (defined in `tasks.remote`) are kicked off wrapped in
-  `RequestTaskHandler`s, which manage a new process and a new thread.
-    - The process runs the actual dbt request, logging via a message queue
-    - eventually just before process exit, the process places an "error" or
-      "result" on the queue
+  `RequestTaskHandler`s, which dispatch to a pre-forked worker process from
+  the `WorkerPool` and manage a new thread.
+    - The worker process runs the actual dbt request, logging via a message
+      queue, and then waits for its next request
+    - eventually, when the request is complete, the worker places an "error"
+      or "result" on the queue
     - The thread monitors the queue, taking logs off the queue and adding them
       to the `RequestTaskHandler`'s `logs` attribute.
     - The thread also monitors the `is_alive` state of the process, in case
       it is killed "unexpectedly" (including via `kill`)
-    - When the thread sees an error or result come over the queue, it join()s
-      the process.
+    - When the thread sees an error or result come over the queue, it checks
+      the worker back into the pool for reuse.
     - When the thread sees that the process has disappeared without placing
       anything on the queue, it checks the queue one last time, and then acts
       as if the queue received an 'Unexpected termination' error
-- `kill` commands pointed at an asynchronous task kill the process and allow
-  the thread to handle cleanup and management
+- `kill` commands pointed at an asynchronous task kill the worker process
+  and allow the thread to handle cleanup and management; the pool forks a
+  replacement worker on demand
 - When the RPC server receives a shutdown instruction, it:
   - stops responding to requests
   - `kills` all processes (triggering the end of all processes, right!?)
@@ -0,0 +1,208 @@
+"""A faster transport for the worker -> parent result/log channel.
+
+A stock `multiprocessing.Queue` routes every message through a feeder
+thread, a pickle, and a pipe syscall on each side. The result/log channel
+has exactly one writer (the worker process) and one reader (the handler
+thread), so a single-producer/single-consumer ring buffer in shared memory
+can carry the same length-prefixed pickled frames without any of that
+per-message machinery.
+
+The ring stores frames as a circular byte stream: the writer appends
+"<length><payload>" and advances the tail, the reader consumes bytes and
+advances the head. A partially received frame is buffered on the reader
+side across calls, so a timed-out read never loses data, and frames larger
+than the ring stream through it in chunks.
+
+Where `multiprocessing.shared_memory` is unavailable (python < 3.8), or
+when the start method is not fork (the ring is inherited, not pickled), we
+fall back to a plain `multiprocessing.Queue`.
+"""
+import multiprocessing
+import os
+import pickle
+import struct
+import time
+from queue import Empty
+from typing import Any, Optional
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None  # type: ignore
+
+
+DEFAULT_RING_SIZE: int = 8 * 1024 * 1024
+# how long the reader (or a writer waiting for free space) sleeps between
+# polls of the shared indices
+_SPIN_SLEEP: float = 0.0005
+_LENGTH = struct.Struct('<I')
+
+
+class ShmRingQueue:
+    """An SPSC ring buffer over shared memory, exposing the subset of the
+    `multiprocessing.Queue` interface the rpc package uses (`put_nowait`,
+    `get`, `get_nowait`).
+
+    The head/tail indices are monotonically increasing byte counters; the
+    bytes in flight are `tail - head` and each index is only ever written
+    by one side, so no lock is required.
+    """
+    def __init__(self, size: int = DEFAULT_RING_SIZE) -> None:
+        if shared_memory is None:
+            raise RuntimeError(
+                'ShmRingQueue requires multiprocessing.shared_memory'
+            )
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        # .buf is typed Optional, but a freshly created segment always has
+        # a buffer; bind it once so indexing type-checks
+        assert self._shm.buf is not None
+        self._buf: memoryview = self._shm.buf
+        self._size = size
+        self._head = multiprocessing.Value('q', 0, lock=False)
+        self._tail = multiprocessing.Value('q', 0, lock=False)
+        # reader-side reassembly state for a partially received frame
+        self._frame: Optional[bytearray] = None
+        self._frame_len = 0
+        # a wakeup pipe so the reader side can be watched by a selector:
+        # the writer nudges it on every put, the reader drains it wholesale
+        # via clear_ready(). Both ends are non-blocking; a full pipe is fine
+        # because one stale byte is enough to signal readiness.
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+
+    # writer (worker process) side
+
+    def put_nowait(self, obj: Any) -> None:
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        self._write_bytes(_LENGTH.pack(len(data)) + data)
+
+    def _notify(self) -> None:
+        try:
+            os.write(self._wfd, b'\x00')
+        except BlockingIOError:
+            # the pipe is full of unread wakeups; readiness is already set
+            pass
+
+    def _write_bytes(self, data: bytes) -> None:
+        size = self._size
+        buf = self._buf
+        offset = 0
+        remaining = len(data)
+        while remaining:
+            free = size - (self._tail.value - self._head.value)
+            if free <= 0:
+                # the reader is behind; wait for it to drain some bytes
+                time.sleep(_SPIN_SLEEP)
+                continue
+            pos = self._tail.value % size
+            num = min(remaining, free, size - pos)
+            buf[pos:pos + num] = data[offset:offset + num]
+            self._tail.value += num
+            offset += num
+            remaining -= num
+            # nudge the reader after every chunk, not once per frame: a
+            # selector-driven reader (async dispatch) only runs on wakeups,
+            # and a frame bigger than the free ring space needs the reader
+            # to drain mid-write or this loop never finishes
+            self._notify()
+
+    # reader (parent) side
+
+    def _wait_for(
+        self, num: int, block: bool, deadline: Optional[float]
+    ) -> None:
+        """Wait until at least `num` unread bytes are available, raising
+        `queue.Empty` on timeout (without consuming anything).
+        """
+        while (self._tail.value - self._head.value) < num:
+            if not block:
+                raise Empty
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Empty
+            time.sleep(_SPIN_SLEEP)
+
+    def _peek(self, num: int, offset: int = 0) -> bytes:
+        size = self._size
+        buf = self._buf
+        pos = (self._head.value + offset) % size
+        end = pos + num
+        if end <= size:
+            return bytes(buf[pos:end])
+        return bytes(buf[pos:size]) + bytes(buf[:end - size])
+
+    def _read_available(self, num: int) -> bytes:
+        """Consume and return up to `num` unread bytes (possibly none)."""
+        take = min(num, self._tail.value - self._head.value)
+        if take <= 0:
+            return b''
+        data = self._peek(take)
+        self._head.value += take
+        return data
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        deadline: Optional[float] = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if self._frame is None:
+            self._wait_for(_LENGTH.size, block, deadline)
+            (self._frame_len,) = _LENGTH.unpack(self._peek(_LENGTH.size))
+            self._head.value += _LENGTH.size
+            self._frame = bytearray()
+        # consume the payload as it streams in: frames larger than the ring
+        # arrive in chunks, and a timeout mid-frame resumes on the next call
+        while len(self._frame) < self._frame_len:
+            chunk = self._read_available(self._frame_len - len(self._frame))
+            if chunk:
+                self._frame += chunk
+                continue
+            if not block:
+                raise Empty
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Empty
+            time.sleep(_SPIN_SLEEP)
+        data = bytes(self._frame)
+        self._frame = None
+        return pickle.loads(data)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def fileno(self) -> int:
+        """The fd a selector can watch for readability of this queue."""
+        return self._rfd
+
+    def clear_ready(self) -> None:
+        """Drain the wakeup pipe. Callers should follow up with get_nowait()
+        until Empty, since wakeups and frames are not one-to-one.
+        """
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self) -> None:
+        try:
+            os.close(self._rfd)
+            os.close(self._wfd)
+        except OSError:
+            pass
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except FileNotFoundError:
+            # the other side (or a resource tracker) beat us to the unlink
+            pass
+
+
+def make_message_queue():
+    """Build the best available worker -> parent message channel: a shared
+    memory ring where supported, otherwise a `multiprocessing.Queue`.
+    """
+    if (
+        shared_memory is None or
+        multiprocessing.get_start_method(allow_none=False) != 'fork'
+    ):
+        return multiprocessing.Queue()
+    return ShmRingQueue()
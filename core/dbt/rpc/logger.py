@@ -1,3 +1,8 @@
+import collections
+import os
+import threading
+import time
+
 import logbook
 import logbook.queues
 from jsonrpc.exceptions import JSONRPCError
@@ -5,12 +10,12 @@ from hologram import JsonSchemaMixin
 from hologram.helpers import StrEnum
 
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
 from queue import Empty
-from typing import Optional, Any, Union
+from typing import Optional, Any, List, Tuple, Union
 
 from dbt.contracts.results import RemoteCompileResult, RemoteExecutionResult
 from dbt.exceptions import InternalException
+from dbt.rpc.fastqueue import ShmRingQueue
 from dbt.utils import restrict_to
 
 
@@ -36,7 +41,9 @@ class QueueLogMessage(QueueMessage):
     message_type: QueueMessageType = field(
         metadata=restrict_to(QueueMessageType.Log)
     )
-    record: logbook.LogRecord
+    # Optional because pooled wrappers (see _LOG_MSG_POOL) drop their record
+    # between uses; a message actually in flight always carries one
+    record: Optional[logbook.LogRecord]
 
     @classmethod
     def from_record(cls, record: logbook.LogRecord):
@@ -99,16 +106,121 @@ class QueueLogHandler(logbook.queues.MultiProcessingHandler):
         self.queue.put_nowait(QueueResultMessage.from_result(result))
 
 
-def _next_timeout(
-    started: datetime,
-    timeout: Optional[float],
-) -> Optional[float]:
-    if timeout is None:
-        return None
+def _load_log_batch_settings() -> Tuple[int, float]:
+    """Parse DBT_RPC_LOG_BATCH, a '<max records>:<max delay in ms>' pair
+    controlling how aggressively workers batch log messages.
+    """
+    raw = os.environ.get('DBT_RPC_LOG_BATCH')
+    if raw:
+        try:
+            size, interval_ms = raw.split(':', 1)
+            return int(size), int(interval_ms) / 1000.0
+        except ValueError:
+            pass
+    return 64, 0.005
+
+
+LOG_BATCH_SIZE, LOG_BATCH_INTERVAL = _load_log_batch_settings()
+
+# A small pool of QueueLogMessage wrappers. Log-heavy tasks allocate (and
+# immediately discard) one wrapper per record; reusing them keeps the gc
+# quiet in the worker. Per-process state: each worker has its own.
+_LOG_MSG_POOL: collections.deque = collections.deque(maxlen=256)
+
+
+def _borrow_log_message(record: logbook.LogRecord) -> QueueLogMessage:
+    try:
+        msg = _LOG_MSG_POOL.pop()
+    except IndexError:
+        return QueueLogMessage.from_record(record)
+    msg.record = record
+    return msg
+
+
+def _return_log_messages(batch: List[QueueLogMessage]) -> None:
+    for msg in batch:
+        # don't keep the record (and whatever it references) alive
+        msg.record = None
+        _LOG_MSG_POOL.append(msg)
+
+
+class BatchingQueueLogHandler(QueueLogHandler):
+    """A QueueLogHandler that accumulates log records in a local buffer and
+    flushes them onto the queue as a single list, so verbose tasks pay one
+    pickle+pipe round-trip per batch instead of per record.
+
+    A daemon thread flushes the buffer every LOG_BATCH_INTERVAL seconds, or
+    as soon as it reaches LOG_BATCH_SIZE records. Errors and results flush
+    the buffer first, so ordering is preserved and no log is lost.
+    """
+    def __init__(self, queue, *args, **kwargs) -> None:
+        super().__init__(queue, *args, **kwargs)
+        self._buf: List[QueueLogMessage] = []
+        self._buf_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stopped = False
+        # the ring serializes inside put_nowait, so once a flush returns the
+        # wrapper objects are dead and can go back to the pool. A stock
+        # multiprocessing.Queue pickles later, on its feeder thread, so
+        # reuse would race it.
+        self._reusable = isinstance(queue, ShmRingQueue)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def emit(self, record: logbook.LogRecord):
+        with self._buf_lock:
+            self._buf.append(_borrow_log_message(record))
+            full = len(self._buf) >= LOG_BATCH_SIZE
+        if full:
+            self._flush_event.set()
+
+    def flush(self):
+        with self._buf_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        # callers hold _buf_lock: it orders batches on the queue, and it is
+        # also what keeps the ring single-producer - the flusher thread and
+        # a thread emitting a terminal error/result must never put
+        # concurrently
+        if self._buf:
+            batch, self._buf = self._buf, []
+            self.queue.put_nowait(batch)
+            if self._reusable:
+                _return_log_messages(batch)
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._flush_event.wait(LOG_BATCH_INTERVAL)
+            self._flush_event.clear()
+            self.flush()
+
+    def emit_error(self, error: JSONRPCError):
+        # flush buffered logs and put the terminal message under one lock
+        # hold, so the flusher can't interleave (or race) the two puts
+        with self._buf_lock:
+            self._flush_locked()
+            self.queue.put_nowait(QueueErrorMessage.from_error(error))
 
-    end = started + timedelta(seconds=timeout)
-    message_timeout = end - datetime.utcnow()
-    return message_timeout.total_seconds()
+    def emit_result(self, result: RemoteCallableResult):
+        with self._buf_lock:
+            self._flush_locked()
+            self.queue.put_nowait(QueueResultMessage.from_result(result))
+
+    def close(self):
+        self._stopped = True
+        self._flush_event.set()
+        self.flush()
+        super().close()
+
+
+def _next_timeout(deadline: Optional[float]) -> Optional[float]:
+    """Given a monotonic-clock deadline (or None for no timeout), return the
+    number of seconds left until it expires.
+    """
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
 
 
 class QueueSubscriber(logbook.queues.MultiProcessingSubscriber):
@@ -127,12 +239,23 @@ class QueueSubscriber(logbook.queues.MultiProcessingSubscriber):
     def recv(
         self,
         timeout: Optional[float] = None
-    ) -> QueueMessage:
+    ) -> Union[QueueMessage, List[QueueLogMessage]]:
         """Receives one record from the socket, loads it and dispatches it.
         Returns the message type if something was dispatched or `None` if it
         timed out.
+
+        The received object may also be a non-empty list of log messages,
+        batched up by a `BatchingQueueLogHandler` on the worker side.
         """
         rv = self._recv_raw(timeout)
+        if isinstance(rv, list):
+            if not rv or not all(
+                isinstance(m, QueueLogMessage) for m in rv
+            ):
+                raise InternalException(
+                    'Got invalid queue message batch: {}'.format(rv)
+                )
+            return rv
         if not isinstance(rv, QueueMessage):
             raise InternalException(
                 'Got invalid queue message: {}'.format(rv)
@@ -144,7 +267,13 @@ class QueueSubscriber(logbook.queues.MultiProcessingSubscriber):
         timeout: Optional[float]
     ) -> QueueMessage:
         msg = self.recv(timeout)
-        if isinstance(msg, QueueLogMessage):
+        if isinstance(msg, list):
+            for log_message in msg:
+                logbook.dispatch_record(log_message.record)
+            # batches only ever contain log messages, so return the last one:
+            # it is non-terminating and the caller will keep waiting
+            return msg[-1]
+        elif isinstance(msg, QueueLogMessage):
             logbook.dispatch_record(msg.record)
             return msg
         elif msg.message_type in QueueMessageType.terminating:
@@ -154,13 +283,25 @@ class QueueSubscriber(logbook.queues.MultiProcessingSubscriber):
                 'Got invalid queue message type {}'.format(msg.message_type)
             )
 
+    def drain(self) -> None:
+        """Discard anything left on the queue, so a stale message can never
+        leak into the next request that reads from this subscriber.
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                return
+
     def dispatch_until_exit(
         self,
-        started: datetime,
-        timeout: Optional[float] = None
+        deadline: Optional[float] = None
     ) -> QueueMessage:
+        """Dispatch messages until a terminating one arrives, or until
+        `deadline` (a `time.monotonic()` timestamp) passes.
+        """
         while True:
-            message_timeout = _next_timeout(started, timeout)
+            message_timeout = _next_timeout(deadline)
             msg = self.handle_message(message_timeout)
             if msg.message_type in QueueMessageType.terminating:
                 return msg
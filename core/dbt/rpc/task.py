@@ -1,5 +1,6 @@
 import base64
 import inspect
+import pickle
 from abc import ABCMeta, abstractmethod
 from typing import Union, List, Optional, Type
 
@@ -14,9 +15,45 @@ from dbt.task.compile import CompileTask
 class RemoteCallable(metaclass=ABCMeta):
     METHOD_NAME: Optional[str] = None
     is_async = False
+    # the params type for this task, precomputed per class so requests
+    # don't pay for the reflection in _reflect_parameters
+    _PARAMS_CLS: Optional[Type[JsonSchemaMixin]] = None
+    # lazily-cached pickle of this instance, for dispatch to workers
+    _pickled_payload: Optional[bytes] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        try:
+            cls._PARAMS_CLS = cls._reflect_parameters()
+        except TypeError:
+            # abstract/intermediate subclasses have no usable annotation on
+            # handle_request yet; they answer get_parameters() reflectively
+            cls._PARAMS_CLS = None
+
+    def pickled(self) -> bytes:
+        """Return this task pickled for dispatch to a worker process.
+
+        Task instances are long-lived - the manager replaces them wholesale
+        when the manifest is recompiled - so the (potentially manifest-sized)
+        payload only has to be pickled on the first dispatch, not on every
+        request.
+        """
+        if self._pickled_payload is None:
+            # the cache attribute is still None here, so it is not included
+            # in the pickle itself
+            self._pickled_payload = pickle.dumps(
+                self, pickle.HIGHEST_PROTOCOL
+            )
+        return self._pickled_payload
 
     @classmethod
     def get_parameters(cls) -> Type[JsonSchemaMixin]:
+        if cls._PARAMS_CLS is not None:
+            return cls._PARAMS_CLS
+        return cls._reflect_parameters()
+
+    @classmethod
+    def _reflect_parameters(cls) -> Type[JsonSchemaMixin]:
         argspec = inspect.getfullargspec(cls.handle_request)
         annotations = argspec.annotations
         if 'params' not in annotations:
@@ -1,17 +1,24 @@
 import multiprocessing
+import os
 import signal
 import threading
+import time
 import uuid
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, Union, Optional, List
+from typing import Any, Callable, ClassVar, Dict, Union, Optional, List
 
+import logbook
 from hologram import JsonSchemaMixin, ValidationError
 from hologram.helpers import StrEnum
 
 import dbt.exceptions
-from dbt.adapters.factory import cleanup_connections
-from dbt.logger import GLOBAL_LOGGER as logger, list_handler, LogMessage
+from dbt.logger import (
+    GLOBAL_LOGGER as logger,
+    list_handler,
+    ListLogHandler,
+    LogMessage,
+)
 from dbt.rpc.error import (
     dbt_error,
     server_error,
@@ -21,8 +28,9 @@ from dbt.rpc.error import (
 from dbt.rpc.logger import (
     RemoteCallableResult,
     QueueSubscriber,
-    QueueLogHandler,
+    BatchingQueueLogHandler,
     QueueErrorMessage,
+    QueueLogMessage,
     QueueResultMessage,
     QueueTimeoutMessage,
 )
@@ -34,6 +42,10 @@ from queue import Queue  # noqa
 
 
 SINGLE_THREADED_HANDLER = env_set_truthy('DBT_SINGLE_THREADED_HANDLER')
+# opt in to monitoring all in-flight requests from one event loop instead of
+# one blocked thread per request. The threaded path remains the default
+# while this burns in.
+ASYNC_DISPATCH = env_set_truthy('DBT_RPC_ASYNC_DISPATCH')
 
 
 class TaskHandlerState(StrEnum):
@@ -43,6 +55,10 @@ class TaskHandlerState(StrEnum):
     Success = 'success'
     Error = 'error'
 
+    # populated right after the class body: a value-less annotation does
+    # not become an enum member, but an assigned dict would
+    _RANK: ClassVar[Dict['TaskHandlerState', int]]
+
     def __lt__(self, other) -> bool:
         """A logical ordering for TaskHandlerState:
 
@@ -50,41 +66,39 @@ class TaskHandlerState(StrEnum):
         """
         if not isinstance(other, TaskHandlerState):
             raise TypeError('cannot compare to non-TaskHandlerState')
-        order = (self.NotStarted, self.Initializing, self.Running)
-        smaller = set()
-        for value in order:
-            smaller.add(value)
-            if self == value:
-                return other not in smaller
-
-        return False
+        return self._RANK[self] < self._RANK[other]
 
     def __le__(self, other) -> bool:
         # so that ((Success <= Error) is True)
-        return ((self < other) or
-                (self == other) or
-                (self.finished and other.finished))
+        if not isinstance(other, TaskHandlerState):
+            raise TypeError('cannot compare to non-TaskHandlerState')
+        return self._RANK[self] <= self._RANK[other]
 
     def __gt__(self, other) -> bool:
         if not isinstance(other, TaskHandlerState):
             raise TypeError('cannot compare to non-TaskHandlerState')
-        order = (self.NotStarted, self.Initializing, self.Running)
-        smaller = set()
-        for value in order:
-            smaller.add(value)
-            if self == value:
-                return other in smaller
-        return other in smaller
+        return self._RANK[self] > self._RANK[other]
 
     def __ge__(self, other) -> bool:
         # so that ((Success <= Error) is True)
-        return ((self > other) or
-                (self == other) or
-                (self.finished and other.finished))
+        if not isinstance(other, TaskHandlerState):
+            raise TypeError('cannot compare to non-TaskHandlerState')
+        return self._RANK[self] >= self._RANK[other]
 
     @property
     def finished(self) -> bool:
-        return self == self.Error or self == self.Success
+        return self._RANK[self] == 3
+
+
+# Success and Error share a rank so that they compare equal in ordering
+# terms: both `Success <= Error` and `Error <= Success` hold.
+TaskHandlerState._RANK = {
+    TaskHandlerState.NotStarted: 0,
+    TaskHandlerState.Initializing: 1,
+    TaskHandlerState.Running: 2,
+    TaskHandlerState.Success: 3,
+    TaskHandlerState.Error: 3,
+}
 
 
 def sigterm_handler(signum, frame):
@@ -99,51 +113,126 @@ def _task_bootstrap(
     """_task_bootstrap runs first inside the child process"""
     signal.signal(signal.SIGTERM, sigterm_handler)
     # the first thing we do in a new process: push logging back over our queue
-    handler = QueueLogHandler(queue)
-    with handler.applicationbound():
-        rpc_exception = None
-        result = None
-        try:
-            result = task.handle_request(params=params)
-        except RPCException as exc:
-            rpc_exception = exc
-        except dbt.exceptions.RPCKilledException as exc:
-            # do NOT log anything here, you risk triggering a deadlock on the
-            # queue handler we inserted above
-            rpc_exception = dbt_error(exc)
-        except dbt.exceptions.Exception as exc:
-            logger.debug('dbt runtime exception', exc_info=True)
-            rpc_exception = dbt_error(exc)
-        except Exception as exc:
-            logger.debug('uncaught python exception', exc_info=True)
-            rpc_exception = server_error(exc)
-
-        # put whatever result we got onto the queue as well.
-        if rpc_exception is not None:
-            handler.emit_error(rpc_exception.error)
-        elif result is not None:
-            handler.emit_result(result)
-        else:
-            error = dbt_error(dbt.exceptions.InternalException(
-                'after request handling, neither result nor error is None!'
-            ))
-            handler.emit_error(error.error)
+    handler = BatchingQueueLogHandler(queue)
+    # also keep our own copy of the log messages: if the request errors out,
+    # we serialize them onto the error here, once, instead of making the
+    # parent re-serialize the copy it collected off the queue. Bound
+    # application-wide, not thread-bound: tasks run their nodes on runner
+    # threads, whose records we need too.
+    error_logs: List[LogMessage] = []
+    error_handler = ListLogHandler(lst=error_logs, bubble=True)
+    try:
+        with handler.applicationbound(), error_handler.applicationbound():
+            rpc_exception = None
+            result = None
+            try:
+                result = task.handle_request(params=params)
+            except RPCException as exc:
+                rpc_exception = exc
+            except dbt.exceptions.RPCKilledException as exc:
+                # do NOT log anything here, you risk triggering a deadlock on
+                # the queue handler we inserted above
+                rpc_exception = dbt_error(exc)
+            except dbt.exceptions.Exception as exc:
+                logger.debug('dbt runtime exception', exc_info=True)
+                rpc_exception = dbt_error(exc)
+            except Exception as exc:
+                logger.debug('uncaught python exception', exc_info=True)
+                rpc_exception = server_error(exc)
+
+            # put whatever result we got onto the queue as well. Both of
+            # these flush any batched logs first.
+            if rpc_exception is not None:
+                rpc_exception.logs = [l.to_dict() for l in error_logs]
+                handler.emit_error(rpc_exception.error)
+            elif result is not None:
+                handler.emit_result(result)
+            else:
+                error = dbt_error(dbt.exceptions.InternalException(
+                    'after request handling, neither result nor error is '
+                    'None!'
+                ))
+                handler.emit_error(error.error)
+    finally:
+        # stop the batching flush thread - in single-threaded mode this all
+        # runs in the server process, where it would otherwise leak
+        handler.close()
+
+
+def _handle_error_message(
+    handler: 'RequestTaskHandler', msg: QueueErrorMessage
+) -> RemoteCallableResult:
+    raise RPCException.from_error(msg.error)
+
+
+def _handle_timeout_message(
+    handler: 'RequestTaskHandler', msg: QueueTimeoutMessage
+) -> RemoteCallableResult:
+    if not handler._single_threaded:
+        assert handler.worker is not None
+        handler.worker.terminate()
+    raise timeout_error(handler.timeout)
+
+
+def _handle_result_message(
+    handler: 'RequestTaskHandler', msg: QueueResultMessage
+) -> RemoteCallableResult:
+    return msg.result
+
+
+# terminating-message dispatch for get_result: one type() lookup instead of
+# an isinstance chain per delivered message
+_MESSAGE_HANDLERS: Dict[type, Callable[..., RemoteCallableResult]] = {
+    QueueErrorMessage: _handle_error_message,
+    QueueTimeoutMessage: _handle_timeout_message,
+    QueueResultMessage: _handle_result_message,
+}
 
 
 class RequestTaskHandler(threading.Thread):
     """Handler for the single task triggered by a given jsonrpc request."""
+    # a long-lived server holds thousands of finished handlers for ps
+    # history, so keep our attributes in slots. Thread itself still gives
+    # instances a __dict__ (it has no __slots__ of its own), but the names
+    # listed here get C-level slot storage and lookup.
+    __slots__ = (
+        'manager', 'task', 'http_request', 'json_rpc_request', 'method',
+        'request_source', 'request_id', 'subscriber', 'process', 'worker',
+        'task_params', 'thread', 'started', 'started_monotonic', 'ended',
+        'timeout', '_task_id_str', '_task_id', 'result',
+        'error', 'state', 'logs', '_list_handler',
+    )
+
     def __init__(self, manager, task, http_request, json_rpc_request):
         self.manager = manager
         self.task = task
         self.http_request = http_request
         self.json_rpc_request = json_rpc_request
+        # cached as plain attributes: the task manager reads these repeatedly
+        # (ps rows, log formatting), so don't pay for a property call each
+        # time. The method also goes into the thread name below.
+        self.method: str = task.METHOD_NAME
+        self.request_source: str = http_request.remote_addr
+        self.request_id: Union[str, int] = json_rpc_request._id
         self.subscriber: Optional[QueueSubscriber] = None
         self.process: Optional[multiprocessing.Process] = None
+        # the pooled worker this request was dispatched to, if any. Typed as
+        # Any to avoid a circular import with dbt.rpc.worker_pool.
+        self.worker: Optional[Any] = None
+        self.task_params: Optional[JsonSchemaMixin] = None
         self.thread: Optional[threading.Thread] = None
         self.started: Optional[datetime] = None
+        # the monotonic-clock start time, used for timeout math. `started`
+        # and `ended` stay wall-clock for display in ps output.
+        self.started_monotonic: Optional[float] = None
         self.ended: Optional[datetime] = None
         self.timeout: Optional[float] = None
-        self.task_id: uuid.UUID = uuid.uuid4()
+        # generate the task id from raw random bytes instead of uuid4(),
+        # and render it exactly once: the string form goes into the thread
+        # name, the request token, and ps output, so it must stay the
+        # canonical hyphenated form clients use to correlate the three.
+        self._task_id: uuid.UUID = uuid.UUID(bytes=os.urandom(16), version=4)
+        self._task_id_str: str = str(self._task_id)
         # the are multiple threads potentially operating on these attributes:
         #   - the task manager has the RequestTaskHandler and any requests
         #     might access it via ps/kill, but only for reads
@@ -154,65 +243,22 @@ class RequestTaskHandler(threading.Thread):
         self.error: Optional[RPCException] = None
         self.state: TaskHandlerState = TaskHandlerState.NotStarted
         self.logs: List[LogMessage] = []
+        # under async dispatch there is no per-request thread to bind a log
+        # handler to, so the event-loop callbacks capture into this one
+        self._list_handler: Optional[ListLogHandler] = None
         super().__init__(
-            name='{}-handler-{}'.format(self.task_id, self.method),
+            name='{}-handler-{}'.format(self._task_id_str, self.method),
             daemon=True,  # if the RPC server goes away, we probably should too
         )
 
     @property
-    def request_source(self) -> str:
-        return self.http_request.remote_addr
-
-    @property
-    def request_id(self) -> Union[str, int]:
-        return self.json_rpc_request._id
-
-    @property
-    def method(self) -> str:
-        return self.task.METHOD_NAME
+    def task_id(self) -> uuid.UUID:
+        return self._task_id
 
     @property
     def _single_threaded(self):
         return self.task.args.single_threaded or SINGLE_THREADED_HANDLER
 
-    def _wait_for_results(self) -> RemoteCallableResult:
-        """Wait for results off the queue. If there is an exception raised,
-        raise an appropriate RPC exception.
-
-        This does not handle joining, but does terminate the process if it
-        timed out.
-        """
-        if (
-            self.subscriber is None or
-            self.started is None or
-            self.process is None
-        ):
-            raise dbt.exceptions.InternalException(
-                '_wait_for_results() called before handle()'
-            )
-
-        try:
-            msg = self.subscriber.dispatch_until_exit(
-                started=self.started,
-                timeout=self.timeout,
-            )
-        except dbt.exceptions.Exception as exc:
-            raise dbt_error(exc)
-        except Exception as exc:
-            raise server_error(exc)
-        if isinstance(msg, QueueErrorMessage):
-            raise RPCException.from_error(msg.error)
-        elif isinstance(msg, QueueTimeoutMessage):
-            if not self._single_threaded:
-                self.process.terminate()
-            raise timeout_error(self.timeout)
-        elif isinstance(msg, QueueResultMessage):
-            return msg.result
-        else:
-            raise dbt.exceptions.InternalException(
-                'Invalid message type {} (result={})'.format(msg)
-            )
-
     @contextmanager
     def state_handler(self):
         try:
@@ -242,83 +288,234 @@ class RequestTaskHandler(threading.Thread):
             self.state = TaskHandlerState.Success
 
     def get_result(self) -> RemoteCallableResult:
-        if self.process is None:
+        """Wait for a terminating message off the queue and return the
+        result, with logs attached. If an exception is raised (including by
+        the dispatched task), raise an appropriate RPC exception instead.
+        On timeout, the worker process is terminated.
+        """
+        # a single sanity check here covers the whole wait path: none of
+        # these can become None again once handle() has completed
+        if (
+            self.subscriber is None or
+            self.started is None or
+            self.started_monotonic is None or
+            (self.process is None and not self._single_threaded)
+        ):
             raise dbt.exceptions.InternalException(
                 'get_result() called before handle()'
             )
 
+        # convert the timeout to a monotonic-clock deadline once, instead of
+        # doing wall-clock datetime math on every dispatched message
+        deadline: Optional[float] = None
+        if self.timeout is not None:
+            deadline = self.started_monotonic + self.timeout
+
         try:
-            with list_handler(self.logs):
+            try:
                 try:
-                    result = self._wait_for_results()
-                finally:
-                    if not self._single_threaded:
-                        self.process.join()
+                    msg = self.subscriber.dispatch_until_exit(
+                        deadline=deadline
+                    )
+                except dbt.exceptions.Exception as exc:
+                    raise dbt_error(exc)
+                except Exception as exc:
+                    raise server_error(exc)
+                handle = _MESSAGE_HANDLERS.get(type(msg))
+                if handle is None:
+                    raise dbt.exceptions.InternalException(
+                        'Invalid message type {} (msg={})'.format(
+                            type(msg).__name__, msg
+                        )
+                    )
+                result = handle(self, msg)
+            finally:
+                if not self._single_threaded:
+                    # hand the worker back to the pool. If it was
+                    # terminated on timeout, the pool will reap it and
+                    # fork a replacement on demand. Drop our process
+                    # reference too: the worker may immediately serve
+                    # another request, and a kill on this (finished) task
+                    # must not be able to signal it.
+                    self.manager.worker_pool.checkin(self.worker)
+                    self.worker = None
+                    self.process = None
         except RPCException as exc:
             # RPC Exceptions come already preserialized for the jsonrpc
-            # framework
-            exc.logs = [l.to_dict() for l in self.logs]
+            # framework. Errors from the worker already carry their logs,
+            # serialized in the child; only convert ours when the exception
+            # arrived bare (timeouts, dispatch failures).
+            if not exc.logs:
+                exc.logs = [l.to_dict() for l in self.logs]
             raise
 
-        # results get real logs
-        result.logs = self.logs[:]
+        # results get real logs. Hand ownership of the list to the result
+        # instead of copying it - this can be multi-MB for log-heavy tasks.
+        # Readers (poll) get the logs from the result once we're finished.
+        logs, self.logs = self.logs, []
+        result.logs = logs
         return result
 
     def run(self):
         try:
-            with self.state_handler():
+            # install the log collector once for the thread's whole life,
+            # instead of once per get_result call. This also captures
+            # anything logged while state_handler deals with an exception.
+            with list_handler(self.logs), self.state_handler():
                 self.result = self.get_result()
         except RPCException:
             pass  # rpc exceptions are fine, the managing thread will handle it
 
-    def handle_singlethreaded(self, kwargs):
-        # in single-threaded mode, we're going to remain synchronous, so call
-        # `run`, not `start`, and return an actual result.
+    # -- the async-dispatch path: all of these run as callbacks on the
+    # EventDispatcher's loop thread, never on a per-request thread.
+
+    def _channel_fileno(self) -> int:
+        # only called from the dispatcher, after start() set the subscriber
+        assert self.subscriber is not None
+        queue = self.subscriber.queue
+        fileno = getattr(queue, 'fileno', None)
+        if fileno is not None:
+            return fileno()
+        # multiprocessing.Queue: watch its underlying read pipe. We never
+        # read the pipe directly - readability just means get_nowait() has
+        # (or is about to have) something for us.
+        return queue._reader.fileno()
+
+    def _dispatch_log(self, record: logbook.LogRecord) -> None:
+        # send the record through the regular stacks (console/file/etc),
+        # then capture it ourselves: there's no thread-bound list handler
+        # on the loop thread.
+        assert self._list_handler is not None
+        logbook.dispatch_record(record)
+        if self._list_handler.should_handle(record):
+            self._list_handler.handle(record)
+
+    def _on_data_ready(self) -> None:
+        """Loop callback: our channel became readable. Drain everything
+        available and advance state if a terminating message arrived.
+        """
+        assert self.subscriber is not None
+        clear_ready = getattr(self.subscriber.queue, 'clear_ready', None)
+        if clear_ready is not None:
+            clear_ready()
+        try:
+            while True:
+                msg = self.subscriber.recv(timeout=0)
+                if isinstance(msg, list):
+                    for log_msg in msg:
+                        self._dispatch_log(log_msg.record)
+                elif isinstance(msg, QueueLogMessage):
+                    self._dispatch_log(msg.record)
+                elif isinstance(msg, QueueTimeoutMessage):
+                    # drained everything currently available
+                    return
+                else:
+                    # a terminating error/result message
+                    self._teardown_async()
+                    self._finish(msg)
+                    return
+        except dbt.exceptions.Exception as exc:
+            self._teardown_async()
+            self._finish_error(dbt_error(exc))
+        except Exception as exc:
+            self._teardown_async()
+            self._finish_error(server_error(exc))
+
+    def _on_timeout(self) -> None:
+        """Loop callback: the request's timeout expired."""
+        if self.worker is not None:
+            self.worker.terminate()
+        self._teardown_async()
+        self._finish_error(timeout_error(self.timeout))
+
+    def _teardown_async(self) -> None:
+        self.manager.dispatcher.unregister(self)
+        if self.worker is not None:
+            # like get_result: once the worker is back in the pool it no
+            # longer belongs to this request, so kill must not see it
+            self.manager.worker_pool.checkin(self.worker)
+            self.worker = None
+            self.process = None
+        # make sure to set this _before_ updating state, like state_handler
+        self.ended = datetime.utcnow()
+
+    def _finish(self, msg) -> None:
+        if isinstance(msg, QueueErrorMessage):
+            self._finish_error(RPCException.from_error(msg.error))
+            return
+        # same ownership handoff as get_result
+        result = msg.result
+        logs, self.logs = self.logs, []
+        result.logs = logs
+        self.result = result
+        self.state = TaskHandlerState.Success
+
+    def _finish_error(self, error: RPCException) -> None:
+        if not error.logs:
+            error.logs = [l.to_dict() for l in self.logs]
+        self.error = error
+        self.state = TaskHandlerState.Error
+
+    def handle_singlethreaded(self, params: JsonSchemaMixin):
+        # in single-threaded mode, we're going to remain synchronous: run the
+        # task bootstrap right here in the request thread, rather than
+        # building a multiprocessing.Process just to call its run().
         # note this shouldn't call self.run() as that has different semantics
         # (we want errors to raise)
-        self.process.run()
-        with self.state_handler():
+        assert self.subscriber is not None
+        _task_bootstrap(self.task, self.subscriber.queue, params)
+        # get_result expects run() to have installed the log collector
+        with list_handler(self.logs), self.state_handler():
             self.result = self.get_result()
         return self.result
 
     def start(self):
-        # this is pretty unfortunate, but we have to reset the adapter
-        # cache _before_ we fork on posix. libpq, but also any other
-        # adapters that rely on file descriptors, get really messed up if
-        # you fork(), because the fds get inherited but the state isn't
-        # shared. The child process and the parent might end up trying to
-        # do things on the same fd at the same time.
-        # Also for some reason, if you do this after forking, even without
-        # calling close(), the connection in the parent ends up throwing
-        # 'connection already closed' exceptions
-        cleanup_connections()
-        self.process.start()
+        # dispatch to a pre-forked worker instead of forking ourselves: the
+        # fork (and the adapter connection cleanup that must precede it, see
+        # WorkerPool) already happened at pool construction, off the request
+        # path.
+        worker = self.manager.worker_pool.checkout()
+        self.worker = worker
+        self.process = worker.process
+        self.subscriber = worker.subscriber
+        worker.dispatch(self.task, self.task_params, self.task_id)
         self.state = TaskHandlerState.Running
-        super().start()
+        if ASYNC_DISPATCH:
+            # no monitor thread: the shared event loop watches our channel
+            # and advances our state from its callbacks
+            self._list_handler = ListLogHandler(lst=self.logs, bubble=True)
+            self.manager.dispatcher.register(self)
+        else:
+            super().start()
 
     def handle(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
         self.started = datetime.utcnow()
+        self.started_monotonic = time.monotonic()
         self.state = TaskHandlerState.Initializing
         self.timeout = kwargs.pop('timeout', None)
         try:
             params = self.task.get_parameters().from_dict(kwargs)
         except ValidationError as exc:
-            # raise a TypeError to indicate invalid parameters
+            # raise a TypeError to indicate invalid parameters. Format the
+            # message once here: wrapping the ValidationError itself would
+            # re-render its full schema tree every time the jsonrpc
+            # framework stringifies the error.
+            msg = str(exc)
             self.state = TaskHandlerState.Error
-            raise TypeError(exc)
-        self.subscriber = QueueSubscriber()
-        self.process = multiprocessing.Process(
-            target=_task_bootstrap,
-            args=(self.task, self.subscriber.queue, params)
-        )
+            raise TypeError(msg) from exc
 
         if self._single_threaded:
-            # all requests are synchronous in single-threaded mode. No need to
-            # create a process...
-            return self.handle_singlethreaded(kwargs)
-
+            # run in-process instead of dispatching to the worker pool;
+            # there is no child process at all in this mode. The subscriber
+            # is per-request: with DBT_SINGLE_THREADED_HANDLER set but the
+            # webserver still threaded, these requests can run concurrently,
+            # so a shared queue would cross their messages.
+            self.subscriber = QueueSubscriber()
+            return self.handle_singlethreaded(params)
+
+        self.task_params = params
         self.start()
-        return {'request_token': str(self.task_id)}
+        return {'request_token': self._task_id_str}
 
     def __call__(self, **kwargs) -> Dict[str, Any]:
         # __call__ happens deep inside jsonrpc's framework
@@ -23,6 +23,8 @@ from dbt.logger import LogMessage
 from dbt.rpc.error import dbt_error, RPCException
 from dbt.rpc.task_handler import TaskHandlerState, RequestTaskHandler
 from dbt.rpc.task import RemoteCallable
+from dbt.rpc.dispatcher import EventDispatcher
+from dbt.rpc.worker_pool import WorkerPool
 from dbt.utils import restrict_to
 
 # import this to make sure our timedelta encoder is registered
@@ -274,11 +276,33 @@ class TaskManager:
         self._rpc_task_map = {}
         self._builtins: Dict[str, UnmanagedHandler] = {}
         self.last_compile = LastCompile(status=ManifestStatus.Init)
+        self._worker_pool: Optional[WorkerPool] = None
+        self._dispatcher: Optional[EventDispatcher] = None
         self._lock = multiprocessing.Lock()
         self._gc_settings = GCSettings(
             maxsize=1000, reapsize=500, auto_reap_age=timedelta(days=30)
         )
 
+    @property
+    def worker_pool(self) -> WorkerPool:
+        # create the pool lazily: forking the workers in __init__ would fork
+        # before the server is fully set up.
+        if self._worker_pool is None:
+            with self._lock:
+                if self._worker_pool is None:
+                    self._worker_pool = WorkerPool()
+        return self._worker_pool
+
+    @property
+    def dispatcher(self) -> EventDispatcher:
+        # like the worker pool, created lazily: only used (and its loop
+        # thread only started) under DBT_RPC_ASYNC_DISPATCH
+        if self._dispatcher is None:
+            with self._lock:
+                if self._dispatcher is None:
+                    self._dispatcher = EventDispatcher()
+        return self._dispatcher
+
     def add_request(self, request_handler):
         self.tasks[request_handler.task_id] = request_handler
 
@@ -355,16 +379,26 @@ class TaskManager:
             # nothing to do!
             return KillResult(status)
 
-        status = KillResultStatus.NotStarted
-
-        if task.process is None:
-            return KillResult(status)
-        pid = task.process.pid
-        if pid is None:
-            return KillResult(status)
-
-        if task.process.is_alive():
-            os.kill(pid, signal.SIGINT)
+        if task.state.finished:
+            # the task is done and its worker has gone back to the pool
+            # (where it may already be serving another request), so there
+            # is nothing left to signal
+            return KillResult(KillResultStatus.Finished)
+
+        worker = task.worker
+        if worker is None:
+            # never dispatched (or single-threaded): nothing to signal. A
+            # worker that was already checked back in means the task just
+            # finished under us.
+            if task.state == TaskHandlerState.Running:
+                return KillResult(KillResultStatus.Finished)
+            return KillResult(KillResultStatus.NotStarted)
+
+        # route the signal through the worker's ownership check: the worker
+        # only gets signalled if it is still serving this exact request, so
+        # a request that completes concurrently can never get a recycled
+        # worker's new assignment killed out from under it
+        if worker.kill_if_serving(task.task_id, signal.SIGINT):
             status = KillResultStatus.Killed
         else:
             status = KillResultStatus.Finished
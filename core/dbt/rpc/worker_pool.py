@@ -0,0 +1,223 @@
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import uuid
+from typing import List, Optional
+
+from hologram import JsonSchemaMixin
+
+from dbt.adapters.factory import cleanup_connections
+from dbt.logger import GLOBAL_LOGGER as logger
+from dbt.rpc.fastqueue import make_message_queue
+from dbt.rpc.logger import QueueSubscriber
+from dbt.rpc.task import RPCTask
+from dbt.rpc.task_handler import _task_bootstrap
+
+
+DEFAULT_NUM_WORKERS: int = os.cpu_count() or 1
+
+# resetting the adapter cache before starting workers is only necessary when
+# the child actually inherits our file descriptors, ie. under the posix
+# 'fork' start method. Under 'spawn'/'forkserver' (eg. on Windows) it would
+# just tear down every connection for no correctness benefit.
+_NEED_FORK_CLEANUP: bool = (
+    multiprocessing.get_start_method(allow_none=False) == 'fork'
+)
+
+# how long to wait for a terminated worker to exit before escalating to
+# SIGKILL, and then for the SIGKILL to take effect
+TERMINATE_GRACE: float = 5.0
+KILL_GRACE: float = 2.0
+
+
+def _worker_main(in_queue, out_queue) -> None:
+    """The main loop of a pooled worker process: block on the input queue
+    waiting for dispatched work and run it via `_task_bootstrap`, which sends
+    logs and the final result/error to the parent over the output queue.
+
+    A `None` on the input queue is the shutdown sentinel.
+    """
+    while True:
+        item = in_queue.get()
+        if item is None:
+            return
+        task_blob, params = item
+        task = pickle.loads(task_blob)
+        _task_bootstrap(task, out_queue, params)
+
+
+class Worker:
+    """A single pre-forked worker process, together with the pair of queues
+    used to communicate with it. Workers handle one request at a time, so
+    the output queue never interleaves messages from different requests.
+    """
+    def __init__(self) -> None:
+        self._terminated = False
+        # which request this worker is currently serving, guarded by a lock
+        # so a kill can never land after the worker is recycled
+        self._kill_lock = threading.Lock()
+        self._serving: Optional[uuid.UUID] = None
+        self.in_queue: multiprocessing.Queue = multiprocessing.Queue()
+        # the result/log channel is strictly one writer (the worker), one
+        # reader (the handler thread), so it can use the fast SPSC ring
+        self.out_queue = make_message_queue()
+        # one subscriber for the worker's lifetime: requests borrow it
+        # along with the worker, instead of wrapping the queue anew
+        self.subscriber = QueueSubscriber(queue=self.out_queue)
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(self.in_queue, self.out_queue),
+            # if the RPC server goes away, the workers should too
+            daemon=True,
+        )
+        self.process.start()
+
+    def dispatch(
+        self, task: RPCTask, params: JsonSchemaMixin, task_id: uuid.UUID
+    ) -> None:
+        with self._kill_lock:
+            self._serving = task_id
+        # the task pickles once per manifest compile (see
+        # RemoteCallable.pickled), not once per dispatch - only the (small)
+        # params get serialized per request
+        self.in_queue.put_nowait((task.pickled(), params))
+
+    def finish_request(self) -> None:
+        """Disown the current request. Once this returns, no kill aimed at
+        that request can reach this worker.
+        """
+        with self._kill_lock:
+            self._serving = None
+
+    def kill_if_serving(self, task_id: uuid.UUID, signum: int) -> bool:
+        """Signal the worker if (and only if) it is still serving the given
+        request. Returns whether the signal was sent. Holding the lock
+        against dispatch/finish_request means a kill can never hit a worker
+        that has moved on to another request.
+        """
+        with self._kill_lock:
+            if self._serving != task_id or not self.process.is_alive():
+                return False
+            assert self.process.pid is not None
+            os.kill(self.process.pid, signum)
+            return True
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def terminate(self) -> None:
+        """Terminate the worker (eg. because its request timed out). The
+        pool will reap it at checkin instead of reusing it.
+        """
+        self._terminated = True
+        self.process.terminate()
+
+    def reap(self) -> None:
+        """Wait for a dead or terminated worker to exit, escalating to
+        SIGKILL if it is stuck (eg. in an uninterruptible syscall), then
+        release its queues. Cleanup latency is bounded: the handler thread
+        never blocks indefinitely on a wedged child.
+        """
+        self.process.join(timeout=TERMINATE_GRACE)
+        if self.process.is_alive():
+            # the pid is always set once start() has succeeded
+            assert self.process.pid is not None
+            # Process.kill() requires python 3.7, so send the signal by hand
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join(timeout=KILL_GRACE)
+            if self.process.is_alive():
+                logger.warning(
+                    'Worker process {} did not exit after SIGKILL'
+                    .format(self.process.pid)
+                )
+        self.close()
+
+    def reap_async(self) -> None:
+        """Run reap() on a background thread. reap() can block for the full
+        terminate-plus-kill grace period on a wedged child, and checkin runs
+        on the request handler thread (or, under async dispatch, the shared
+        event loop, which must never block).
+        """
+        threading.Thread(
+            target=self.reap, name='worker-reaper', daemon=True
+        ).start()
+
+    def drain(self) -> None:
+        """Discard anything left on the output queue, so a stale message can
+        never leak into the next request handled by this worker.
+        """
+        self.subscriber.drain()
+
+    def shutdown(self) -> None:
+        self.in_queue.put_nowait(None)
+
+    def close(self) -> None:
+        """Release the queues of a dead worker (for the shared memory ring,
+        this unlinks the region).
+        """
+        self.in_queue.close()
+        self.out_queue.close()
+
+
+class WorkerPool:
+    """A pool of pre-forked worker processes that tasks are dispatched to,
+    instead of forking a fresh process per request.
+
+    This is pretty unfortunate, but we have to reset the adapter cache
+    _before_ we fork on posix. libpq, but also any other adapters that rely
+    on file descriptors, get really messed up if you fork(), because the fds
+    get inherited but the state isn't shared. The child process and the
+    parent might end up trying to do things on the same fd at the same time.
+    Also for some reason, if you do this after forking, even without calling
+    close(), the connection in the parent ends up throwing 'connection
+    already closed' exceptions.
+
+    Pre-forking lets us pay for that cleanup (and the fork itself) once per
+    worker instead of once per request.
+    """
+    def __init__(self, num_workers: Optional[int] = None) -> None:
+        if num_workers is None:
+            num_workers = DEFAULT_NUM_WORKERS
+        self._lock = threading.Lock()
+        self._idle: List[Worker] = []
+        if _NEED_FORK_CLEANUP:
+            cleanup_connections()
+        for _ in range(num_workers):
+            self._idle.append(Worker())
+
+    def checkout(self) -> Worker:
+        """Get an idle worker, growing the pool if every worker is busy.
+        The caller must hand the worker back via `checkin` when the request
+        is complete (or the worker has been killed).
+        """
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+                # the worker died while idle (or was killed); reap it
+                worker.reap_async()
+        # no idle workers: grow the pool. We have to do connection cleanup
+        # before forking, for the same reasons as at pool construction.
+        if _NEED_FORK_CLEANUP:
+            cleanup_connections()
+        return Worker()
+
+    def checkin(self, worker: Optional[Worker]) -> None:
+        if worker is None:
+            return
+        # cut the request's claim on the worker before anything else, so a
+        # late kill for the finished request can't signal it
+        worker.finish_request()
+        if worker._terminated or not worker.is_alive():
+            # the worker was terminated (timeout) or killed; reap it and
+            # drop it on the floor - `checkout` will fork a replacement on
+            # demand. Checking the flag too closes the race where a freshly
+            # terminated worker still reports is_alive().
+            worker.reap_async()
+            return
+        worker.drain()
+        with self._lock:
+            self._idle.append(worker)
@@ -0,0 +1,124 @@
+import multiprocessing
+import select
+import threading
+import unittest
+from queue import Empty
+from unittest import TestCase
+
+from dbt.rpc import fastqueue
+from dbt.rpc.fastqueue import ShmRingQueue, make_message_queue
+
+
+def _fill_queue(queue, count, payload):
+    # runs on a writer thread/process: the ring is SPSC, so there is
+    # exactly one of these per test
+    for i in range(count):
+        queue.put_nowait((i, payload))
+
+
+@unittest.skipIf(
+    fastqueue.shared_memory is None,
+    'requires multiprocessing.shared_memory (python 3.8+)'
+)
+class TestShmRingQueue(TestCase):
+    def setUp(self):
+        self.queue = ShmRingQueue(size=1024)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_roundtrip(self):
+        for obj in (None, 42, 'a string', {'key': ['values', 1]}):
+            self.queue.put_nowait(obj)
+            self.assertEqual(self.queue.get_nowait(), obj)
+
+    def test_empty(self):
+        with self.assertRaises(Empty):
+            self.queue.get_nowait()
+        with self.assertRaises(Empty):
+            self.queue.get(block=True, timeout=0.01)
+
+    def test_wraparound(self):
+        # push far more total bytes through than the ring holds, so the
+        # head/tail offsets wrap several times and frames straddle the end
+        payload = 'x' * 200
+        for i in range(50):
+            self.queue.put_nowait((i, payload))
+            self.assertEqual(self.queue.get_nowait(), (i, payload))
+
+    def test_oversize_frame_streams(self):
+        # a frame much larger than the ring streams through in chunks; the
+        # writer needs its own thread since it flow-controls against us
+        payload = 'y' * 100000
+        writer = threading.Thread(
+            target=_fill_queue, args=(self.queue, 1, payload), daemon=True
+        )
+        writer.start()
+        self.assertEqual(self.queue.get(block=True), (0, payload))
+        writer.join()
+
+    def test_timeout_mid_frame_resumes(self):
+        # reading with a timeout shorter than the frame takes to stream
+        # must not lose the partial frame: the next call picks it back up
+        payload = 'z' * 100000
+        writer = threading.Thread(
+            target=_fill_queue, args=(self.queue, 3, payload), daemon=True
+        )
+        writer.start()
+        received = []
+        while len(received) < 3:
+            try:
+                received.append(self.queue.get(block=True, timeout=0.001))
+            except Empty:
+                continue
+        writer.join()
+        self.assertEqual(received, [(i, payload) for i in range(3)])
+
+    def test_select_driven_reader(self):
+        # mimic the async dispatch path: only read when the wakeup fd says
+        # to. A frame larger than the ring must keep waking us as it
+        # streams, or writer and reader deadlock against each other.
+        payload = 'v' * 100000
+        writer = threading.Thread(
+            target=_fill_queue, args=(self.queue, 1, payload), daemon=True
+        )
+        writer.start()
+        received = None
+        while received is None:
+            readable, _, _ = select.select([self.queue.fileno()], [], [], 5)
+            self.assertTrue(readable, 'no wakeup within 5s: reader starved')
+            self.queue.clear_ready()
+            try:
+                while True:
+                    received = self.queue.get_nowait()
+            except Empty:
+                continue
+        writer.join()
+        self.assertEqual(received, (0, payload))
+
+    @unittest.skipIf(
+        multiprocessing.get_start_method(allow_none=False) != 'fork',
+        'the ring is inherited across fork, not pickled'
+    )
+    def test_cross_process(self):
+        payload = 'w' * 5000
+        writer = multiprocessing.Process(
+            target=_fill_queue, args=(self.queue, 20, payload), daemon=True
+        )
+        writer.start()
+        for i in range(20):
+            self.assertEqual(self.queue.get(block=True), (i, payload))
+        writer.join()
+
+
+class TestMakeMessageQueue(TestCase):
+    def test_queue_type(self):
+        queue = make_message_queue()
+        if (
+            fastqueue.shared_memory is not None and
+            multiprocessing.get_start_method(allow_none=False) == 'fork'
+        ):
+            self.assertIsInstance(queue, ShmRingQueue)
+            queue.close()
+        else:
+            self.assertIsInstance(queue, multiprocessing.queues.Queue)